@@ -8,22 +8,46 @@ Usage:
     python scripts/harvest.py                  # dry run, prints what it found
     python scripts/harvest.py --write          # actually appends to data/doom.json
     python scripts/harvest.py --write --limit 20   # cap at 20 new entries
+    python scripts/harvest.py --refresh        # re-download pages even if cached
 """
 
+import io
+import gzip
 import json
 import re
+import mmap
+import hashlib
 import sys
 import time
 import argparse
-import urllib.request
+import textwrap
+import threading
+import http.client
 import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from html.parser import HTMLParser
 
+try:
+    import lxml.html       # optional: libxml2 parses tables ~10x faster than HTMLParser
+except ImportError:
+    lxml = None
+
+try:
+    import orjson          # optional: much faster load/dump of doom.json, same output
+    _json_loads = orjson.loads
+    _json_dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = lambda obj: json.dumps(obj, indent=2, ensure_ascii=False)
+
 # ── Paths ──────────────────────────────────────────────────────────────────────
 ROOT       = Path(__file__).parent.parent
 DOOM_JSON  = ROOT / "data" / "doom.json"
 CURATOR    = ROOT / "curator.txt"
+CACHE_DIR  = ROOT / ".cache" / "wiki"
+CACHE_TTL  = 7 * 86400   # seconds before a cached page is re-downloaded
 
 # ── Category mapping ───────────────────────────────────────────────────────────
 VALID_CATEGORIES = [
@@ -49,46 +73,173 @@ CATEGORY_KEYWORDS = {
     "War & Conflict":        ["nuclear war", "world war", "armageddon", "invasion", "missile", "bomb", "military"],
 }
 
+# Flat keyword → category map: single words are found with one set intersection
+# against the text's words, only the few multi-word phrases need a substring check
+_KEYWORD_CATEGORY = {kw: cat for cat, kws in CATEGORY_KEYWORDS.items() for kw in kws}
+_KEYWORDS_SINGLE  = frozenset(kw for kw in _KEYWORD_CATEGORY if " " not in kw)
+_KEYWORDS_MULTI   = [kw for kw in _KEYWORD_CATEGORY if " " in kw]
+
 def guess_category(text):
     text = text.lower()
-    scores = {cat: 0 for cat in VALID_CATEGORIES}
-    for cat, keywords in CATEGORY_KEYWORDS.items():
-        for kw in keywords:
-            if kw in text:
-                scores[cat] += 1
+    words = set(_RE_WORD.findall(text))
+    words.update([w[:-1] for w in words if w.endswith("s")])   # "computers" still hits "computer"
+    scores = dict.fromkeys(CATEGORY_KEYWORDS, 0)
+    for kw in words.intersection(_KEYWORDS_SINGLE):
+        scores[_KEYWORD_CATEGORY[kw]] += 1
+    for phrase in _KEYWORDS_MULTI:
+        if phrase in text:
+            scores[_KEYWORD_CATEGORY[phrase]] += 1
     best = max(scores, key=scores.get)
     return best if scores[best] > 0 else "Political Catastrophe"
 
 # ── Wikipedia fetch ────────────────────────────────────────────────────────────
 WIKI_API = "https://en.wikipedia.org/w/api.php"
-HEADERS  = {"User-Agent": "DoomScroll/1.0 (https://github.com/innomen/DoomScroll; open source project)"}
+HEADERS  = {
+    "User-Agent":      "DoomScroll/1.0 (https://github.com/innomen/DoomScroll; open source project)",
+    "Accept-Encoding": "gzip",   # parse.text HTML compresses ~5x; http.client won't decode it for us
+}
 
-def wiki_fetch_html(page_title):
-    """Fetch parsed HTML for a Wikipedia article via the API."""
-    params = urllib.parse.urlencode({
+FETCH_WORKERS  = 4
+QUERY_BATCH    = 50                    # max titles per action=query request
+FETCH_INTERVAL = 0.5                   # min seconds between request starts, across all workers (be polite to Wikipedia)
+FETCH_BACKOFF  = 1.0                   # extra pause for every worker after a failed request
+
+_WIKI_URL   = urllib.parse.urlsplit(WIKI_API)
+_local      = threading.local()        # one keep-alive connection per worker thread
+_throttle   = threading.Lock()
+_next_slot  = 0.0
+
+def _wait_for_slot():
+    """Space out request starts across all workers by FETCH_INTERVAL."""
+    global _next_slot
+    with _throttle:
+        now = time.monotonic()
+        wait = _next_slot - now
+        _next_slot = max(now, _next_slot) + FETCH_INTERVAL
+    if wait > 0:
+        time.sleep(wait)
+
+def _back_off():
+    """After a failure, hold every worker's next request for FETCH_BACKOFF seconds."""
+    global _next_slot
+    with _throttle:
+        _next_slot = max(_next_slot, time.monotonic() + FETCH_BACKOFF)
+
+def _wiki_get(params):
+    """GET the API over this thread's persistent connection, reconnecting once if it went stale."""
+    url = f"{_WIKI_URL.path}?{urllib.parse.urlencode(params)}"
+    _wait_for_slot()
+    for attempt in (1, 2):
+        conn = getattr(_local, "conn", None)
+        if conn is None:
+            conn = _local.conn = http.client.HTTPSConnection(_WIKI_URL.netloc, timeout=15)
+        try:
+            conn.request("GET", url, headers=HEADERS)
+            resp = conn.getresponse()
+            body = resp.read()
+            break
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            _local.conn = None
+            if attempt == 2:
+                _back_off()
+                raise
+    if resp.status != 200:
+        _back_off()
+        raise ValueError(f"HTTP {resp.status} {resp.reason}")
+    if resp.getheader("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body.decode())
+
+def wiki_resolve_titles(titles):
+    """
+    Resolve titles to canonical article names, QUERY_BATCH per request.
+    Follows normalisation and redirects; missing or invalid pages map to None.
+    """
+    resolved = {}
+    for i in range(0, len(titles), QUERY_BATCH):
+        batch = titles[i:i + QUERY_BATCH]
+        data = _wiki_get({
+            "action":      "query",
+            "titles":      "|".join(batch),
+            "redirects":   "1",
+            "formatversion": "2",
+            "format":      "json",
+        })
+        if "error" in data:
+            _back_off()
+            raise ValueError(f"Wikipedia error: {data['error'].get('info', data['error'])}")
+        query     = data.get("query", {})
+        renamed   = {n["from"]: n["to"] for n in query.get("normalized", [])}
+        redirects = {r["from"]: r["to"] for r in query.get("redirects", [])}
+        pages     = {pg["title"]: pg for pg in query.get("pages", [])}
+        for title in batch:
+            name = renamed.get(title, title)
+            name = redirects.get(name, name)
+            page = pages.get(name)
+            resolved[title] = name if page and not (page.get("missing") or page.get("invalid")) else None
+    return resolved
+
+def normalise_title(title):
+    """Local version of MediaWiki's title normalisation: "peak_oil" → "Peak oil"."""
+    title = title.replace("_", " ").strip()
+    return title[:1].upper() + title[1:]
+
+def _cache_path(page_title):
+    key = normalise_title(page_title)
+    return CACHE_DIR / f"{hashlib.sha1(key.encode()).hexdigest()}.html"
+
+def is_cached(page_title):
+    """True if CACHE_DIR holds a copy of the page younger than CACHE_TTL."""
+    path = _cache_path(page_title)
+    return path.exists() and time.time() - path.stat().st_mtime < CACHE_TTL
+
+def wiki_fetch_html(page_title, use_cache=True, refresh=False):
+    """Fetch parsed HTML for a Wikipedia article, serving it from CACHE_DIR while fresh."""
+    path = _cache_path(page_title)
+    if use_cache and not refresh and is_cached(page_title):
+        return path.read_text(encoding="utf-8")
+
+    data = _wiki_get({
         "action":      "parse",
         "page":        page_title,
+        "redirects":   "1",
         "prop":        "text",
         "formatversion": "2",
         "format":      "json",
     })
-    url = f"{WIKI_API}?{params}"
-    req = urllib.request.Request(url, headers=HEADERS)
-    with urllib.request.urlopen(req, timeout=15) as resp:
-        data = json.loads(resp.read().decode())
     if "error" in data:
+        _back_off()
         raise ValueError(f"Wikipedia error: {data['error'].get('info', data['error'])}")
-    return data["parse"]["text"]
+    html = data["parse"]["text"]
+
+    if use_cache:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".part")
+        tmp.write_text(html, encoding="utf-8")
+        tmp.replace(path)   # never leave a half-written page behind
+    return html
 
 # ── HTML table parser ──────────────────────────────────────────────────────────
+_RE_CITE = re.compile(r'\[\d+\]|\[note \d+\]|\[a\]')
+_RE_WS   = re.compile(r'\s+')
+_RE_YEAR = re.compile(r'\b(1[0-9]{3}|20[0-2][0-9])\b')
+_RE_SLUG = re.compile(r'[^a-z0-9]+')
+_RE_WORD = re.compile(r'[a-z0-9]+')
+_RE_TABLE_TAG = re.compile(r'<(/?)table\b', re.IGNORECASE)
+
+_HEADER_WORDS = frozenset(["date", "dates", "year", "years", "century", "centuries",
+                           "event", "events", "prediction", "predictions"])
+
 class TableParser(HTMLParser):
-    """Minimal HTML table parser — returns list of rows, each row a list of cell text."""
+    """Minimal HTML table parser (stdlib fallback when lxml isn't installed)."""
     def __init__(self):
         super().__init__()
         self.tables = []
         self._current_table = None
         self._current_row = None
-        self._current_cell = None
+        self._cell_buf = io.StringIO()   # reused for every cell
+        self._in_cell = False
         self._depth = 0  # track nested tables
 
     def handle_starttag(self, tag, attrs):
@@ -99,7 +250,9 @@ class TableParser(HTMLParser):
         elif tag in ("tr",) and self._depth == 1:
             self._current_row = []
         elif tag in ("td", "th") and self._depth == 1 and self._current_row is not None:
-            self._current_cell = []
+            self._cell_buf.seek(0)
+            self._cell_buf.truncate()
+            self._in_cell = True
 
     def handle_endtag(self, tag):
         if tag == "table":
@@ -112,58 +265,107 @@ class TableParser(HTMLParser):
                 self._current_table.append(self._current_row)
             self._current_row = None
         elif tag in ("td", "th") and self._depth == 1:
-            if self._current_cell is not None and self._current_row is not None:
-                self._current_row.append(" ".join(self._current_cell).strip())
-            self._current_cell = None
+            if self._in_cell and self._current_row is not None:
+                cell = self._cell_buf.getvalue()
+                self._current_row.append(_RE_WS.sub(" ", cell).strip())
+            self._in_cell = False
 
     def handle_data(self, data):
-        if self._current_cell is not None:
-            stripped = data.strip()
-            if stripped:
-                self._current_cell.append(stripped)
+        if self._in_cell:
+            # Space between fragments so "1910<br>Halley's comet" keeps its word boundary;
+            # the cell is whitespace-collapsed once when it closes
+            self._cell_buf.write(data)
+            self._cell_buf.write(" ")
+
+def _table_spans(html):
+    """Yield the source of each top-level <table>…</table>, tracking nesting depth."""
+    depth = start = 0
+    for m in _RE_TABLE_TAG.finditer(html):
+        if not m.group(1):
+            if depth == 0:
+                start = m.start()
+            depth += 1
+        elif depth:
+            depth -= 1
+            if depth == 0:
+                yield html[start:html.find(">", m.end()) + 1]
+    if depth:
+        yield html[start:]   # unclosed at end of page
 
 def extract_tables(html):
-    parser = TableParser()
-    parser.feed(html)
-    return parser.tables
+    """
+    Return each top-level table as a list of rows, each row a list of cell text.
+    Only the table spans are parsed — the prose, infobox and navbox markup around
+    them is most of an article's bytes and is skipped without being tokenised.
+    """
+    spans = _table_spans(html)
+    if lxml is None:
+        parser = TableParser()
+        for span in spans:
+            parser.feed(span)
+        return parser.tables
+    tables = []
+    for span in spans:
+        tbl = lxml.html.fromstring(span)
+        # Join text nodes with a space so "1910<br>Halley's comet" keeps its word boundary
+        rows = [[" ".join(" ".join(c.itertext()).split()) for c in tr.xpath("./td|./th")]
+                for tr in tbl.xpath("./tr|./thead/tr|./tbody/tr|./tfoot/tr")]
+        tables.append([r for r in rows if r])
+    return tables
+
+def _uncited(text):
+    """text with citation markers removed; skips the regex when there's no '['."""
+    return _RE_CITE.sub('', text) if "[" in text else text
 
 def clean(text):
-    """Strip citations like [1], [note 2], extra whitespace."""
-    text = re.sub(r'\[\d+\]', '', text)
-    text = re.sub(r'\[note \d+\]', '', text)
-    text = re.sub(r'\[a\]', '', text)
-    text = re.sub(r'\s+', ' ', text)
+    """Strip citations like [1], [note 2]. Cells arrive whitespace-collapsed from extract_tables."""
+    if "[" in text:
+        text = _RE_WS.sub(' ', _RE_CITE.sub('', text))
     return text.strip()
 
 def slugify(text, year=""):
-    s = re.sub(r'[^a-z0-9]+', '-', (str(year) + "-" + text[:40]).lower())
+    s = _RE_SLUG.sub('-', (str(year) + "-" + text[:40]).lower())
     return s.strip('-')
 
 # ── Row → entry conversion ─────────────────────────────────────────────────────
-def row_to_entry(row, hint, existing_ids):
+def _year_rows(table):
+    """
+    Indices of rows whose first cell mentions a year, found with one regex pass
+    over the whole first column. Relies on extract_tables cells never holding a newline.
+    """
+    first_col = "\n".join(_uncited(row[0]) if row else "" for row in table)
+    hits, line, pos = [], 0, 0
+    for m in _RE_YEAR.finditer(first_col):
+        line += first_col.count("\n", pos, m.start())
+        pos = m.start()
+        if not hits or hits[-1] != line:
+            hits.append(line)
+    return hits
+
+def row_to_entry(row, hint, existing_ids, seen_rows=None, slug_counter=None):
     """
     Try to turn a table row into a doom.json entry.
     Supports two common Wikipedia table shapes:
       Shape A: Date | Claimant | Claim | Outcome   (apocalyptic events article)
       Shape B: Year | Prediction | Source | Outcome (more generic)
+    seen_rows, if given, is a set of raw rows already tried; repeats are skipped.
+    slug_counter, if given, maps base id → next "-N" suffix to try; it is only valid
+    alongside the existing_ids it was built with, with every returned id added to it.
     Returns None if the row doesn't look usable.
     """
     if len(row) < 3:
         return None
 
-    # Flatten and clean all cells
-    cells = [clean(c) for c in row]
-
-    # Skip header rows
-    if any(h in cells[0].lower() for h in ["date", "year", "century", "event", "prediction"]):
-        return None
-
-    # Skip rows that are clearly section dividers (single merged cell etc.)
-    if len(cells) < 3 or not cells[0]:
-        return None
+    # Skip a row repeated within a table or across articles before doing any work on it
+    if seen_rows is not None:
+        key = tuple(row[:4])
+        if key in seen_rows:
+            return None
+        seen_rows.add(key)
 
-    # Try to extract year from first cell
-    year_match = re.search(r'\b(1[0-9]{3}|20[0-2][0-9])\b', cells[0])
+    # Try to extract year from the first cell (minus footnotes like "[1024]") — rejects
+    # most header/divider rows before any other cleaning work is done
+    year_match = _RE_YEAR.search(_uncited(row[0]))
     if not year_match:
         return None
     year = int(year_match.group(1))
@@ -172,6 +374,13 @@ def row_to_entry(row, hint, existing_ids):
     if year >= 2026:
         return None
 
+    # Clean only the cells we use
+    cells = [clean(c) for c in row[:4]]
+
+    # Skip header rows
+    if not _HEADER_WORDS.isdisjoint(_RE_WORD.findall(cells[0].lower())):
+        return None
+
     # Shape detection: if cell[1] looks like a person/org name and cell[2] is longer, it's Shape A
     if len(cells) >= 4:
         claimant   = cells[1]
@@ -187,12 +396,17 @@ def row_to_entry(row, hint, existing_ids):
 
     # Build the entry
     entry_id = slugify(claimant + "-" + prediction[:20], year)
-    # Ensure uniqueness
+    # Ensure uniqueness, resuming from the last suffix handed out for this slug
     base_id = entry_id
-    counter = 1
-    while entry_id in existing_ids:
+    if slug_counter is None:
+        slug_counter = {}
+    counter = slug_counter.get(base_id, 0)
+    if counter:
         entry_id = f"{base_id}-{counter}"
+    while entry_id in existing_ids:
         counter += 1
+        entry_id = f"{base_id}-{counter}"
+    slug_counter[base_id] = counter + 1
 
     # Guess category from prediction + outcome text
     combined = f"{prediction} {outcome} {hint}"
@@ -226,27 +440,50 @@ def parse_curator(path):
         # comment lines ignored
     """
     targets = []
-    for line in path.read_text().splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        parts = [p.strip() for p in line.split("|", 1)]
-        title = parts[0]
-        hint  = parts[1] if len(parts) > 1 else ""
-        targets.append((title, hint))
+    if path.stat().st_size == 0:   # mmap refuses empty files
+        return targets
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for raw in iter(mm.readline, b""):
+            raw = raw.strip()
+            if not raw or raw.startswith(b"#"):   # only decode lines we keep
+                continue
+            title, _, hint = raw.decode("utf-8").partition("|")
+            targets.append((title.strip(), hint.strip()))
     return targets
 
+# ── doom.json writer ───────────────────────────────────────────────────────────
+_RE_ENTRIES_END = re.compile(rb'\s*\]\s*\}\s*\Z')   # closing "  ]\n}" of the entries array
+
+def append_entries(path, new_entries, had_entries):
+    """
+    Splice new entries in before the closing bracket of "entries" (the last key),
+    instead of re-serialising the whole database. Output matches a full indent=2 dump.
+    Returns False, leaving the file untouched, if it doesn't end the expected way.
+    """
+    with open(path, "r+b") as f:
+        size = f.seek(0, 2)
+        start = f.seek(max(0, size - 4096))
+        m = _RE_ENTRIES_END.search(f.read())
+        if not m:
+            return False
+        items = ",\n".join(textwrap.indent(_json_dumps(e), "    ") for e in new_entries)
+        f.seek(start + m.start())
+        f.write(((",\n" if had_entries else "\n") + items + "\n  ]\n}").encode("utf-8"))
+        f.truncate()
+    return True
+
 # ── Main ───────────────────────────────────────────────────────────────────────
 def main():
     parser = argparse.ArgumentParser(description="Harvest Wikipedia tables into doom.json")
     parser.add_argument("--write",  action="store_true", help="Write results to data/doom.json")
     parser.add_argument("--limit",  type=int, default=0, help="Max new entries to add (0 = unlimited)")
     parser.add_argument("--source", type=str, default="", help="Only process lines matching this string")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the on-disk page cache")
+    parser.add_argument("--refresh",  action="store_true", help="Re-download pages even if they are cached")
     args = parser.parse_args()
 
     # Load existing database
-    with open(DOOM_JSON) as f:
-        db = json.load(f)
+    db = _json_loads(DOOM_JSON.read_bytes())
     existing_ids = {e["id"] for e in db["entries"]}
     print(f"📚 Existing entries: {len(existing_ids)}")
 
@@ -260,34 +497,65 @@ def main():
         targets = [(t, h) for t, h in targets if args.source.lower() in t.lower()]
     print(f"🎯 Curator targets: {len(targets)}\n")
 
-    new_entries = []
-
-    for title, hint in targets:
-        print(f"📡 Fetching: {title} ...", end=" ", flush=True)
+    # Titles without a fresh cached copy are resolved first: one query per QUERY_BATCH
+    # titles follows redirects and weeds out dead pages before any parse call is made.
+    # A fully cached rerun makes no network calls at all.
+    reuse_cache = not args.no_cache and not args.refresh
+    resolved = {t: normalise_title(t) for t, _ in targets}
+    uncached = [t for t, _ in targets if not (reuse_cache and is_cached(t))]
+    if uncached:
         try:
-            html  = wiki_fetch_html(title)
-            tables = extract_tables(html)
-            print(f"{len(tables)} table(s) found")
+            resolved.update(wiki_resolve_titles(uncached))
         except Exception as e:
-            print(f"ERROR — {e}")
-            time.sleep(1)
-            continue
-
-        for table in tables:
-            for row in table:
-                entry = row_to_entry(row, hint + " " + title, existing_ids | {e["id"] for e in new_entries})
-                if entry:
-                    new_entries.append(entry)
-                    existing_ids.add(entry["id"])
-                    if args.limit and len(new_entries) >= args.limit:
-                        break
-            if args.limit and len(new_entries) >= args.limit:
-                break
+            print(f"⚠️  Couldn't resolve titles ({e}) — fetching them as listed\n")
 
-        time.sleep(0.5)  # be polite to Wikipedia
-        if args.limit and len(new_entries) >= args.limit:
-            print(f"\n🏁 Limit of {args.limit} reached.")
-            break
+    pages = {}
+    for title, hint in targets:
+        page = resolved[title]
+        if page is None:
+            print(f"📡 Fetching: {title} ... ERROR — no such page")
+        elif page not in pages:   # several curator lines can point at one article
+            pages[page] = (title, hint)
+
+    new_entries = []
+    limit       = args.limit
+    seen_rows   = set()   # raw rows already tried, across all pages
+    slug_counter = {}     # base id → next "-N" suffix to try, kept in step with existing_ids
+
+    # Fetch in parallel, but parse on the main thread in curator order so output,
+    # --limit cut-offs and id suffixes don't depend on network timing
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+        # Popped as they're parsed, so each page's HTML is freed once its tables are read
+        futs = deque((ex.submit(wiki_fetch_html, title, use_cache=not args.no_cache, refresh=args.refresh), (title, hint))
+                     for title, hint in pages.values())
+        while futs:
+            fut, (title, hint) = futs.popleft()
+            print(f"📡 Fetching: {title} ...", end=" ", flush=True)
+            try:
+                html  = fut.result()
+                tables = extract_tables(html)
+                print(f"{len(tables)} table(s) found")
+            except Exception as e:
+                print(f"ERROR — {e}")
+                continue
+
+            # Hot loop: keep per-row work to the row_to_entry call itself
+            page_hint = f"{hint} {title}"
+            for table in tables:
+                for i in _year_rows(table):   # rows with no year can't become entries
+                    entry = row_to_entry(table[i], page_hint, existing_ids, seen_rows, slug_counter)
+                    if entry:
+                        new_entries.append(entry)
+                        existing_ids.add(entry["id"])
+                        if limit and len(new_entries) >= limit:
+                            break
+                if limit and len(new_entries) >= limit:
+                    break
+
+            if limit and len(new_entries) >= limit:
+                print(f"\n🏁 Limit of {limit} reached.")
+                ex.shutdown(wait=False, cancel_futures=True)
+                break
 
     print(f"\n✨ Found {len(new_entries)} new entries")
 
@@ -303,9 +571,10 @@ def main():
         print(f"  ... and {len(new_entries) - 5} more")
 
     if args.write:
+        had_entries = bool(db["entries"])
         db["entries"].extend(new_entries)
-        with open(DOOM_JSON, "w") as f:
-            json.dump(db, f, indent=2, ensure_ascii=False)
+        if list(db)[-1] != "entries" or not append_entries(DOOM_JSON, new_entries, had_entries):
+            DOOM_JSON.write_text(_json_dumps(db), encoding="utf-8")
         print(f"\n✅  Wrote {len(new_entries)} entries to {DOOM_JSON}")
         print(f"   Total entries now: {len(db['entries'])}")
         print("\n💡 Tip: review entries with _harvested:true before committing.")